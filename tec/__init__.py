@@ -1,52 +1,83 @@
-from tec.peek import print_source, print_signature
-
-from tec.modules import (
-    loaded_module_from_dotpath_and_filepath,
-    second_party_names,
-    filepath_to_dotpath,
-    get_imported_module_paths,
-    ModulesReader,
-    ModuleAllAttrsReader,
-    ModuleAttrsReader,
-)
-
-from tec.pip_packaging import (
-    create_github_repo,
-    get_last_pypi_version_number,
-    format_str_vals_of_dict,
-    ujoin,
-)
-
-from tec.packages import print_top_level_diagnosis
-
-from tec.stores import (  # lots of this moved to xdol/pystores
-    file_contents_to_short_description,
-    find_short_description_for_pkg,
-    PyFilesReader,
-    builtins_py_files,
-    sitepackages_py_files,
-    py_files_with_contents_matching_pattern,
-)
-
-from xdol import PkgReader  # because used to be defined in tec
-
-from tec.import_counting import (
-    modules_imported,
-    modules_imported_count,
-    base_module_name,
-)
-
-from tec.util import (
-    find,
-    extract_encoding_from_contents,
-    get_encoding,
-    decoding_problem_sentinel,
-    decode_or_default,
-    resolve_module_filepath,
-    resolve_to_folder,
-    resolve_module_contents,
-    import_and_add_if_available,
-    find_objects,
-    name_and_object_pairs,
-    print_signatures,
-)
+"""Tools to inspect python objects.
+
+The objects below are imported lazily (on first attribute access), so that
+``import tec`` doesn't import all of tec's modules (and their dependencies).
+"""
+
+import importlib as _importlib
+import pkgutil as _pkgutil
+
+# name -> module to import it from
+_LAZY = {
+    # tec.peek
+    'print_source': 'tec.peek',
+    'print_signature': 'tec.peek',
+    # tec.modules
+    'loaded_module_from_dotpath_and_filepath': 'tec.modules',
+    'second_party_names': 'tec.modules',
+    'filepath_to_dotpath': 'tec.modules',
+    'get_imported_module_paths': 'tec.modules',
+    'ModulesReader': 'tec.modules',
+    'ModuleAllAttrsReader': 'tec.modules',
+    'ModuleAttrsReader': 'tec.modules',
+    # tec.pip_packaging
+    'create_github_repo': 'tec.pip_packaging',
+    'get_last_pypi_version_number': 'tec.pip_packaging',
+    'format_str_vals_of_dict': 'tec.pip_packaging',
+    'ujoin': 'tec.pip_packaging',
+    # tec.packages
+    'print_top_level_diagnosis': 'tec.packages',
+    # tec.stores (lots of this moved to xdol/pystores)
+    'file_contents_to_short_description': 'tec.stores',
+    'find_short_description_for_pkg': 'tec.stores',
+    'PyFilesReader': 'tec.stores',
+    'PkgReader': 'tec.stores',
+    'builtins_py_files': 'tec.stores',
+    'sitepackages_py_files': 'tec.stores',
+    'py_files_with_contents_matching_pattern': 'tec.stores',
+    # tec.import_counting
+    'modules_imported': 'tec.import_counting',
+    'modules_imported_count': 'tec.import_counting',
+    'base_module_name': 'tec.import_counting',
+    # tec.util
+    'find': 'tec.util',
+    'extract_encoding_from_contents': 'tec.util',
+    'get_encoding': 'tec.util',
+    'decoding_problem_sentinel': 'tec.util',
+    'decode_or_default': 'tec.util',
+    'resolve_module_filepath': 'tec.util',
+    'resolve_to_folder': 'tec.util',
+    'resolve_module_contents': 'tec.util',
+    'import_and_add_if_available': 'tec.util',
+    'find_objects': 'tec.util',
+    'name_and_object_pairs': 'tec.util',
+    'print_signatures': 'tec.util',
+}
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name):
+    module_name = _LAZY.get(name)
+    if module_name is None:
+        # a submodule (e.g. tec.util), which used to be imported (so bound) by tec
+        try:
+            obj = _importlib.import_module(f"{__name__}.{name}")
+        except ModuleNotFoundError as e:
+            if e.name != f"{__name__}.{name}":  # the submodule is there, but failed
+                raise
+            raise AttributeError(
+                f"module {__name__!r} has no attribute {name!r}"
+            ) from None
+    else:
+        obj = getattr(_importlib.import_module(module_name), name)
+    globals()[name] = obj  # so __getattr__ isn't called for this name again
+    return obj
+
+
+def _submodule_names():
+    return {m.name for m in _pkgutil.iter_modules(__path__)}
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY) | _submodule_names())
@@ -22,11 +22,33 @@ My take on that is:
 
 Gathered here are some tools to get the problem's solution off the ground.
 
-Note: The module requires `ast_scope` and `graphviz` to be installed.
+Note: The graph functions require `ast_scope` and `graphviz` to be installed.
 """
 
+import ast
+import inspect
+from functools import lru_cache
+
 from i2.footprints import object_dependencies as _object_dependencies
 
+try:
+    import ast_scope
+    import ast_scope.graph
+except ModuleNotFoundError:
+    ast_scope = None
+
+try:
+    from graphviz import Digraph
+except ModuleNotFoundError:
+    Digraph = None
+
+
+def _assert_installed(module, pip_name):
+    if module is None:
+        raise ModuleNotFoundError(
+            f"You need {pip_name} for this. Install it with: pip install {pip_name}"
+        )
+
 object_dependencies = _object_dependencies
 
 # def dependencies_of_package(pkg: str):
@@ -56,25 +78,26 @@ object_dependencies = _object_dependencies
 
 
 def get_source_string(obj: object) -> str:
-    import inspect
-
     if isinstance(obj, str):
         return obj
     return inspect.getsource(obj)
 
 
+@lru_cache(maxsize=256)
 def source_string_to_ast_scope_graph(source_string: str):
-    import ast
-    import ast_scope
+    """The ast_scope static dependency graph of a source string.
 
+    Note: Results are cached (on the source string), so the same graph object is
+    returned for the same source. Don't mutate it.
+    """
+    _assert_installed(ast_scope, "ast_scope")
     tree = ast.parse(source_string)
     scope_info = ast_scope.annotate(tree)
     return scope_info.static_dependency_graph
 
 
 def to_ast_scope_graph(obj: object):
-    import ast_scope.graph
-
+    _assert_installed(ast_scope, "ast_scope")
     if isinstance(obj, ast_scope.graph.DiGraph):
         return obj
     return source_string_to_ast_scope_graph(get_source_string(obj))
@@ -93,10 +116,11 @@ def dependency_graph_for(
     obj: object, prefix='rankdir="LR"', suffix="", **digraph_kwargs
 ):
     """Get graphviz Digraph object of the dependencies of a python object"""
+    _assert_installed(Digraph, "graphviz")
     graph = to_ast_scope_graph(obj)
-    from graphviz import Digraph
-
-    return Digraph(
-        **digraph_kwargs,
-        body=[*prefix.split("\n"), *ast_scope_graph_to_dot(graph), *suffix.split("\n")],
-    )
+    # Digraph body items are raw dot source, so each needs its own line ending
+    body = [f"{line}\n" for line in prefix.split("\n")]
+    for from_, to_ in graph.edges():
+        body.append(f"{from_} -> {to_}\n")
+    body.extend(f"{line}\n" for line in suffix.split("\n"))
+    return Digraph(**digraph_kwargs, body=body)
@@ -7,24 +7,54 @@ having snakefood installed. See: http://furius.ca/snakefood/doc/snakefood-doc.ht
 """
 import re
 import os
-from io import StringIO
+import sys
+import ast
+import pickle
+import hashlib
+import tempfile
+import warnings
+from contextlib import suppress
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 from collections import Counter
-from tec.util import resolve_module_contents, resolve_to_folder, resolve_module_filepath
-from tec.stores import PyFilesReader
+from typing import Union
+from tec.util import (
+    resolve_to_folder,
+    resolve_module_filepath,
+    iter_py_filepaths,
+    DFLT_MAX_PROCESSES,
+)
 
 file_sep = os.path.sep
 module_import_regex_tmpl = "(?<=from) {package_name}|(?<=[^\s]import) {package_name}"
 
 any_module_import_regex = re.compile(module_import_regex_tmpl.format(package_name=r'\w+'))
 
-spaced_comma_re = re.compile(r"\s*,\s*")
-another_import_regex = re.compile(
-    r"^\s*from\s+(?P<from_import>[\w\.]+)\s+import"
-    r"|^\s*import (?P<multiple>[\w\.,]+)"
+# An import statement, at the start of a line or after a ; statement separator.
+# Either ``from <from_import> import ...`` or ``import <multiple>`` where multiple is a
+# comma separated list of (possibly aliased) dot paths.
+# It's a bytes pattern, so file contents can be scanned without decoding them.
+# (\x80-\xff is there to match the utf-8 bytes of non-ascii identifiers.)
+import_statement_re = re.compile(
+    rb"(?:^|;)[ \t]*(?:"
+    rb"from[ \t]+(?P<from_import>[\w.\x80-\xff]+)[ \t]+import\b"
+    rb"|import[ \t]+(?P<multiple>"
+    rb"[\w.\x80-\xff]+(?:[ \t]+as[ \t]+\w+)?"
+    rb"(?:[ \t]*,[ \t]*[\w.\x80-\xff]+(?:[ \t]+as[ \t]+\w+)?)*"
+    rb"))",
+    re.MULTILINE,
 )
-commented_line_re = re.compile(r'\s*#')
 token_re = re.compile(r'[\w\.]+')
 
+# Where the imports parsed out of .py files are persisted (set to None to disable)
+DFLT_IMPORTS_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'tec',
+    'imports',
+)
+# Bump when what's cached changes (e.g. how imports are parsed), to ignore old entries
+IMPORTS_CACHE_FORMAT_VERSION = 1
+
 
 def mk_single_package_import_regex(module_name):
     """Make a regular expression to parse out a specific module name in the context of an import."""
@@ -38,72 +68,203 @@ def mk_multiple_package_import_regex(module_names):
     return re.compile('|'.join([mk_single_package_import_regex(x).pattern for x in module_names]))
 
 
-def modules_imported(obj, only_base_name=False):
+def modules_imported(obj, only_base_name=False, workers=None):
     """Generator of module names from obj.
     
-    Note: The process uses regular expressions to parse out imported names from string contents.
-    The process in by no means accurate in all cases. 
+    Note: The process parses the code with ``ast``, falling back to regular expressions
+    for contents that aren't parsable python. The latter is by no means accurate in all cases.
     It may have false positives (strings that have import patterns, but are not actual code imports).
-    It may have false negatives (relative imports (as in ``..name``) and "dynamically" imported, etc.
+    Either way, there will be false negatives: "dynamically" imported modules, etc.
 
     If you need something more precise, look into other tools (snakefood or findimports for example).
     
     :param obj: module object, file or folder path, or anything that can resolve to that
     :param only_base_name: If True, will only return the first part of the dot names
+    :param workers: Number of processes to parse the files of a package with
+        (see ``modules_imported_under_folder``)
     :return: Generator of module (dot path) names
     
     
     >>> import os.path  # single module
     >>> list(modules_imported(os.path))  # list of names in the order they were found
-    ['os', 'sys', 'stat', 'genericpath', 'genericpath', 'pwd', 'pwd', 're', 're']
+    ['os', 'sys', 'stat', 'genericpath', 'genericpath', 'pwd', 'pwd', 're', 're', 'posix']
     >>> import os  # package with several modules
     >>> from collections import Counter
     >>> Counter(modules_imported(os, only_base_name=True)).most_common()  #doctest: +ELLIPSIS
-    [('nt', 5), ('posix', 4), ... ('warnings', 1), ('subprocess', 1)]
+    [('nt', 5), ('posix', 4), ...]
 
     """
     if only_base_name:
-        yield from map(base_module_name, modules_imported(obj))
+        yield from map(base_module_name, modules_imported(obj, workers=workers))
     else:
         obj = resolve_module_filepath(obj, assert_output_is_existing_filepath=False)
         if obj.endswith('__init__.py'):
             folder = resolve_to_folder(obj)
-            yield from modules_imported_under_folder(folder)
+            yield from modules_imported_under_folder(folder, workers=workers)
         else:  # so obj is a filepath or the code string to be analyzed
             yield from modules_imported_by_module(obj)
 
 
-def modules_imported_count(obj, only_base_name=False):
+def modules_imported_count(obj, only_base_name=False, workers=None):
     """A dict containing the imported names and their counts, sorted from most frequent to least.
-    """
-    return dict(Counter(set(modules_imported(obj, only_base_name=only_base_name))))
-
 
-def _normalize_line(line):
-    """Compress any comma separated items so that no space appears before or after the commas
-    >>> _normalize_line("here, is  ,   a stronge ,csv   line")
-    'here,is,a stronge,csv   line'
+    >>> modules_imported_count("import os, sys\\nimport os.path\\nfrom os import path", only_base_name=True)
+    {'os': 3, 'sys': 1}
     """
-    return spaced_comma_re.sub(',', line)
+    imported = modules_imported(obj, only_base_name=only_base_name, workers=workers)
+    return dict(Counter(imported).most_common())
+
 
+def imports_in_py_content(py_content: Union[str, bytes]):
+    r"""Generator of imported names parsed out of input code (string or bytes).
 
-def imports_in_py_content(py_content: str):
-    r"""Generator of imported names parsed out (with regex) of input code (string)
+    The code is parsed with ``ast`` when it can be, and with regular expressions
+    (see ``_regex_imports``) when it can't (e.g. python 2 code, or a snippet).
 
     >>> list(imports_in_py_content("import inspect ,  sys ;  import os.path\n  from collections.abc import Mapping"))
     ['inspect', 'sys', 'os.path', 'collections.abc']
+    >>> list(imports_in_py_content("import numpy as np, pandas as pd\n# import not_this"))
+    ['numpy', 'pandas']
+    >>> list(imports_in_py_content("from os import (\n    path,\n    sep,\n)\nx = 'import not_this'"))
+    ['os']
 
     """
+    tree = _ast_or_none(py_content)
+    if tree is None:
+        yield from _regex_imports(py_content)
+    else:
+        yield from _imports_in_ast(tree)
+
+
+def _regex_imports(py_content: Union[str, bytes]):
+    r"""Generator of imported names parsed out (with regex) of input code (string or bytes)
 
-    for line in StringIO(py_content + '\n'):
-        if not commented_line_re.match(line):
-            for subline in _normalize_line(line).split(';'):
-                r = another_import_regex.search(subline)
-                if r is not None:
-                    import_str = next((v for k, v in r.groupdict().items() if v is not None), None)
-                    if import_str is not None:
-                        for import_name in import_str.split(','):
-                            yield import_name
+    >>> list(_regex_imports("import inspect ,  sys ;  import os.path\n  from collections.abc import Mapping"))
+    ['inspect', 'sys', 'os.path', 'collections.abc']
+    >>> list(_regex_imports(b"print 'python 2'\nimport caf\xc3\xa9 as cafe, os"))
+    ['café', 'os']
+
+    """
+    if isinstance(py_content, str):
+        py_content = py_content.encode('utf-8', 'replace')
+    if b'import' not in py_content:  # (a C-level substring search, much cheaper than regex)
+        return
+    for match in import_statement_re.finditer(py_content):
+        from_import, multiple = match.group('from_import', 'multiple')
+        if from_import is not None:
+            yield from_import.decode('utf-8', 'replace')
+        elif b',' not in multiple and b' ' not in multiple and b'\t' not in multiple:
+            # the common case: a single, non-aliased, dot path
+            yield multiple.decode('utf-8', 'replace')
+        else:
+            for import_str in multiple.split(b','):
+                # the dot path, without the "as alias"
+                yield import_str.split()[0].decode('utf-8', 'replace')
+
+
+def _ast_or_none(py_content, filename='<unknown>'):
+    """The ast of py_content (str or bytes), or None if it's not parsable python"""
+    try:
+        with warnings.catch_warnings():  # don't want the SyntaxWarnings of others' code
+            warnings.simplefilter('ignore')
+            return ast.parse(py_content, filename)
+    except (SyntaxError, ValueError):  # e.g. python 2 code, or null bytes
+        return None
+    except (MemoryError, RecursionError):  # valid, but too long or nested for the parser
+        return None
+
+
+def _imports_in_ast(tree):
+    """Generator of imported names of an ast, in the order they appear in the code.
+
+    Relative imports keep their leading dots (``from ..x import y`` gives ``'..x'``).
+    """
+    import_nodes = [
+        node for node in ast.walk(tree) if isinstance(node, (ast.Import, ast.ImportFrom))
+    ]
+    import_nodes.sort(key=lambda node: (node.lineno, node.col_offset))
+    for node in import_nodes:
+        if isinstance(node, ast.ImportFrom):
+            yield '.' * node.level + (node.module or '')
+        else:
+            for alias in node.names:
+                yield alias.name
+
+
+def _parse_imports_of_file(filepath):
+    """List of imported names of a .py file, parsed with ast (or regex if ast can't)"""
+    with open(filepath, 'rb') as fp:
+        contents = fp.read()
+    tree = _ast_or_none(contents, filepath)
+    if tree is None:
+        return list(_regex_imports(contents))
+    return list(_imports_in_ast(tree))
+
+
+def _imports_cache_filepath(filepath, cache_dir):
+    # (which imports ast finds, or if it can parse the file at all, depends on the
+    # python version, so each version has its own entries)
+    version = 'py{}.{}-v{}'.format(*sys.version_info[:2], IMPORTS_CACHE_FORMAT_VERSION)
+    name = hashlib.sha1(filepath.encode()).hexdigest() + '.pkl'
+    return os.path.join(cache_dir, version, name)
+
+
+_dflt_cache_dir = object()  # sentinel, to use the DFLT_IMPORTS_CACHE_DIR of call time
+
+
+def _disk_cached_imports_of_file(filepath, stat_key, cache_dir=_dflt_cache_dir):
+    """The imports of filepath, read from the pickle cache if the (mtime, size) stat_key
+    matches the one it was stored with, and (re)computed (and stored) if not."""
+    if cache_dir is _dflt_cache_dir:
+        cache_dir = DFLT_IMPORTS_CACHE_DIR
+    if cache_dir is None:
+        return _parse_imports_of_file(filepath)
+    cache_filepath = _imports_cache_filepath(filepath, cache_dir)
+    try:
+        with open(cache_filepath, 'rb') as fp:
+            cached_stat_key, names = pickle.load(fp)
+        if cached_stat_key == stat_key:
+            return names
+    except Exception:  # no (valid) cache entry (missing, corrupt, foreign...)
+        pass  # will (re)compute it, and overwrite the entry
+    names = _parse_imports_of_file(filepath)
+    try:
+        _write_cache_entry(cache_filepath, (stat_key, names))
+    except OSError:
+        pass  # caching is only an optimization
+    return names
+
+
+def _write_cache_entry(cache_filepath, obj):
+    """Pickle obj to cache_filepath, atomically: concurrent readers (or writers, like the
+    processes of modules_imported_under_folder) never see a half written file"""
+    cache_dir = os.path.dirname(cache_filepath)
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_filepath = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            pickle.dump(obj, fp)
+        os.replace(tmp_filepath, cache_filepath)
+    except BaseException:
+        with suppress(OSError):
+            os.remove(tmp_filepath)
+        raise
+
+
+@lru_cache(maxsize=4096)
+def _imports_from_path(filepath, mtime, size):
+    return tuple(_disk_cached_imports_of_file(filepath, (mtime, size)))
+
+
+def imports_of_filepath(filepath):
+    """Tuple of imported names of a .py file.
+
+    Results are cached (in memory and on disk, see ``DFLT_IMPORTS_CACHE_DIR``),
+    and only recomputed when the file's modification time or size changes.
+    """
+    filepath = os.path.abspath(filepath)
+    stat = os.stat(filepath)
+    return _imports_from_path(filepath, stat.st_mtime_ns, stat.st_size)
 
 
 def modules_imported_by_module(module):
@@ -116,38 +277,67 @@ def modules_imported_by_module(module):
 
     The input can be a filepath
 
-    >>> list(modules_imported_by_module(__file__))
-    ['re', 'os', 'io', 'collections', 'tec.util', 'tec.stores', 'os.path']
+    >>> list(modules_imported_by_module(__file__))  # doctest: +NORMALIZE_WHITESPACE
+    ['re', 'os', 'sys', 'ast', 'pickle', 'hashlib', 'tempfile', 'warnings', 'contextlib',
+     'functools', 'concurrent.futures', 'collections', 'typing', 'tec.util']
 
     ... a imported module object
 
     >>> import wave
     >>> list(modules_imported_by_module(wave))
-    ['builtins', 'audioop', 'struct', 'sys', 'chunk', 'collections', 'warnings']
+    ['collections', 'builtins', 'struct', 'sys']
 
     ... the string contents themselves
 
+    >>> list(modules_imported_by_module("import os\nfrom collections import abc"))
+    ['os', 'collections']
+
+    Files (including those of module objects) are parsed once, then taken from a
+    cache until they're modified (see ``imports_of_filepath``).
+
     """
-    module_contents = resolve_module_contents(module)
-    yield from imports_in_py_content(module_contents)
+    if not isinstance(module, str) or os.path.isdir(module):
+        module = resolve_module_filepath(module)
+    if os.path.isfile(module):
+        yield from imports_of_filepath(module)
+    else:
+        yield from imports_in_py_content(module)
 
     #
     # t = subprocess.check_output(['sfood-imports', '-u', module])
     # return [x for x in t.split('\n') if len(x) > 0]
 
 
-def modules_imported_under_folder(root):
+def _imports_of_filepath_or_empty(filepath):
+    try:
+        return imports_of_filepath(filepath)
+    except OSError:  # unreadable (or vanished) file: skip it
+        return ()
+
+
+def modules_imported_under_folder(root, workers=None):
     """Generator of imported module (dot path) names
 
-    :param root:
+    :param root: folder (or anything that resolves to one) to look for .py files in
+    :param workers: If given, and more than 1, the number of processes to parse the
+        files with (capped to ``DFLT_MAX_PROCESSES``). Worth it for large folders
+        (like site-packages) whose files aren't in the imports cache yet.
     :return:
     """
     root = resolve_to_folder(root)
-    for filename, contents in PyFilesReader(root).items():
-        yield from modules_imported_by_module(contents)
-
-
-base_name_re = re.compile('\w+')
+    filepaths = iter_py_filepaths(root, include_hidden=True)
+    if workers is not None and workers > 1:
+        executor = ProcessPoolExecutor(max_workers=min(workers, DFLT_MAX_PROCESSES))
+        try:
+            for names in executor.map(
+                _imports_of_filepath_or_empty, list(filepaths), chunksize=64
+            ):
+                yield from names
+        finally:  # (if we stop early, don't wait for the pending files)
+            executor.shutdown(wait=False, cancel_futures=True)
+    else:
+        for filepath in filepaths:
+            yield from _imports_of_filepath_or_empty(filepath)
 
 
 def base_module_name(module_name_dot_path):
@@ -159,10 +349,10 @@ def base_module_name(module_name_dot_path):
 
     >>> base_module_name("..relatively_imported")
     ''
+    >>> base_module_name('')
+    ''
 
     """
-    r = base_name_re.match(module_name_dot_path)
-    if r:
-        return r.group(0)
-    else:
-        return ""
+    if module_name_dot_path[:1] == '.':
+        return ''
+    return module_name_dot_path.partition('.')[0]
@@ -0,0 +1,70 @@
+"""Misc tools"""
+
+import os
+import configparser
+from functools import lru_cache
+from pathlib import Path
+
+from tec.pkg_code import DFLT_SKIP_DIRNAMES
+
+readme_path_for_setup_path = (
+    lambda setup_path: setup_path[: -len("setup.cfg")] + "README.md"
+)
+
+
+@lru_cache(maxsize=1024)
+def _setup_cfg_description(setup_path, mtime_ns):
+    """The metadata description of a setup.cfg file (mtime_ns is there to key the cache)"""
+    config = configparser.ConfigParser(interpolation=None)
+    with open(setup_path, "rb") as fp:
+        config.read_string(fp.read().decode("utf-8", "replace"), setup_path)
+    return config["metadata"].get("description", "")
+
+
+def setup_cfg_description(setup_path):
+    """The metadata description of a setup.cfg file, cached until the file changes"""
+    return _setup_cfg_description(setup_path, os.stat(setup_path).st_mtime_ns)
+
+
+def infos_of_packages_under_rootdir(rootdir, skip_dirs=DFLT_SKIP_DIRNAMES):
+    """Yields information about packages found recursively under rootdir
+
+    Examples:
+
+    ```python
+    from collections import defaultdict
+    from operator import itemgetter
+    rootdir = 'PROJECTS_ROOT_DIR'
+
+    project_info_for_group = defaultdict(list)
+    for group, *info in infos_of_packages_under_rootdir(rootdir):
+         project_info_for_group[group].append(info)
+
+    for group, projects in project_info_for_group.items():
+        print(f"----- {group} ---------")
+        for project_name, description, readme in projects:
+            one_line_description = description.replace('\n', ' ')
+            print(f"{project_name}: {one_line_description}")
+    ```
+
+    """
+    if not rootdir.endswith(os.path.sep):
+        rootdir += os.path.sep
+    rootdir_len = len(rootdir)
+
+    for dirpath, dirnames, filenames in os.walk(rootdir):
+        # (in place, so os.walk doesn't go in them) hidden folders aren't walked either
+        dirnames[:] = [
+            d for d in dirnames if not d.startswith(".") and d not in skip_dirs
+        ]
+        if "setup.cfg" in filenames and "README.md" in filenames:
+            setup_path = os.path.join(dirpath, "setup.cfg")
+            readme_path = readme_path_for_setup_path(setup_path)
+            try:
+                project_relpath = setup_path[rootdir_len : -len("setup.cfg")]
+                *rel_path, project_name, _ = project_relpath.split(os.path.sep)
+                description = setup_cfg_description(setup_path)
+                readme = Path(readme_path).read_text(errors="replace")
+                yield os.path.sep.join(rel_path), project_name, description, readme
+            except Exception as e:
+                print(f"Skipping {setup_path} because of error: {e}")
@@ -24,12 +24,14 @@ DFLT_FILENAME_FILT = {'oto.pth', 'conda.pth', 'custom.pth'}.__contains__
 
 
 def lines_of_file(filepath):
-    return Path(filepath).read_text().splitlines()
+    with open(filepath) as fp:
+        return fp.read().splitlines()
 
 
 def get_lines(lines: Lines):
     if isinstance(lines, str):
-        if os.path.isfile(lines):
+        # (content with newlines can't be a filepath, so no need to stat it)
+        if '\n' not in lines and os.path.isfile(lines):
             filepath = lines
             return lines_of_file(lines)
         elif ';' in lines:
@@ -46,32 +48,79 @@ def get_lines(lines: Lines):
 
 
 def missing_items(target: Iterable, source: Iterable):
-    return [x for x in source if x not in target]
+    """Items of source that are not in target (in source order, without duplicates)
+    >>> missing_items(['one', 'two'], ['three', 'one', 'four', 'three'])
+    ['three', 'four']
+
+    A set (or dict) target is used as is, other iterables are turned into a set first.
+    >>> missing_items({'one', 'two'}, ['three', 'one', 'three'])
+    ['three']
+    """
+    if not isinstance(target, (set, frozenset, dict)):
+        target = set(target)
+    seen = set()  # the missing items we already have
+    missing = []
+    for x in source:
+        if x not in target and x not in seen:
+            missing.append(x)
+            seen.add(x)
+    return missing
 
 
 def add_missing_items(target: Iterable, source: Iterable):
-    return list(target) + missing_items(target, source)
+    """Target items followed by the source items that weren't already there
+    >>> add_missing_items(iter(['one', 'two']), ['three', 'one', 'three'])
+    ['one', 'two', 'three']
+    """
+    items = list(target)  # (target is iterated only once, so can be an iterator)
+    items.extend(missing_items(items, source))
+    return items
 
 
 def target_and_missing_items(target: Lines, source: Lines = ()):
     """Add source lines to target lines
     >>> target_and_missing_items(['one', 'two', '', 'three'], ['four', '', 'five'])
     (['one', 'two', '', 'three'], ['four', 'five'])
+    >>> target_and_missing_items(['one', 'two'], ['three', 'one', 'three'])
+    (['one', 'two'], ['three'])
     """
     target, source = map(get_lines, [target, source])
     return target, missing_items(target, source)
 
 
 def add_missing_lines(target: Filepath, source: Lines = ()):
-    """Add source lines to target lines
-    >>> _add_missing_lines(['one', 'two', '', 'three'], ['four', '', 'five'])
+    """Add source lines to the target file (if they're not there already), returning
+    the lines that were added.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as rootdir:
+    ...     target = os.path.join(rootdir, 'some.pth')
+    ...     _ = Path(target).write_text('one\\ntwo\\n\\nthree')
+    ...     added = add_missing_lines(target, ['four', '', 'five'])
+    ...     lines = lines_of_file(target)
+    >>> added
+    ['four', 'five']
+    >>> lines
     ['one', 'two', '', 'three', 'four', 'five']
     """
-    target_lines, missing_lines = target_and_missing_items(target, source)
-    Path(target).write_text('\n'.join(target_lines + missing_lines))
+    try:
+        with open(target) as fp:
+            target_content = fp.read()  # the only read of target
+    except FileNotFoundError:
+        target_content = None
+    target_lines = target_content.splitlines() if target_content else []
+    missing_lines = missing_items(target_lines, get_lines(source))
+    if missing_lines:
+        # only the missing lines are written (appended, in one write), not the whole file
+        sep = '\n' if target_content and not target_content.endswith(('\n', '\r')) else ''
+        with open(target, 'a') as fp:
+            fp.write(sep + '\n'.join(missing_lines))
+    elif target_content is None:
+        open(target, 'w').close()  # nothing to add, but target is still created
     return missing_lines
 
 
+@lru_cache(maxsize=1)
 def first_site_packages_folder_found():
     return site.getsitepackages()[0]
 
@@ -81,9 +130,19 @@ def get_site_packages_folder(site_packages_folder=None):
         return first_site_packages_folder_found()
 
 
+@lru_cache(maxsize=8)
+def _file_names_of_folder(folder):
+    with os.scandir(folder) as entries:
+        # (entry.is_file uses the file type the OS listed the entry with: no stat call)
+        return tuple(entry.name for entry in entries if entry.is_file())
+
+
 def all_pth_file_names(site_packages_folder=None):
+    """Names of the files of the site-packages folder.
+    Note: Listed once per process (use ``_file_names_of_folder.cache_clear()`` to refresh)
+    """
     site_packages_folder = site_packages_folder or get_site_packages_folder()
-    return os.listdir(site_packages_folder)
+    return list(_file_names_of_folder(site_packages_folder))
 
 
 def filtered_pth_file_names(
@@ -132,28 +191,9 @@ def add_to_pth_file(lines, pth_filepath=None):
 # ----------------------------------------------------------------------------------------------------------------------
 # Look at local files
 
-from dol import filt_iter, wrap_kvs, Pipe, cache_iter
-from dol.filesys import FileCollection
 from pathlib import Path
-from dol.filesys import DirCollection
-
-from tec.pkg_code import (
-    dir_whose_parent_has_same_name,
-    package_root_dirs,
-    root_dirpaths_to_packages,
-    init_root,
-    pkg_root,
-    init_file_of_pkg_root,
-    is_package_init,
-)
-
-# This one is slower than the one given by package_root_dirs
-#  since here we look through all files to only filter for the name/name/__init__.py
-_OldPackages = Pipe(
-    filt_iter(FileCollection, filt=is_package_init),
-    wrap_kvs(key_of_id=pkg_root, id_of_key=init_file_of_pkg_root),
-    cache_iter,
-)
+
+from tec.pkg_code import root_dirpaths_to_packages
 
 
 def add_paths_of_packages_under_rootdir(rootdir, pth_filepath=None):
@@ -142,8 +142,19 @@ LOADED, DOTPATH, PATH, FILEPATH, FOLDERPATH = map(
 )
 
 
+# Modules compiled into the interpreter (always importable, whatever sys.path is)
+_builtin_module_names = frozenset(sys.builtin_module_names)
+
+
 def is_module_dotpath(dotpath):
-    """Checks if a dotpath points to a module."""
+    """Checks if a dotpath points to a module.
+
+    >>> is_module_dotpath('os.path'), is_module_dotpath('sys'), is_module_dotpath('os.sep')
+    (True, True, False)
+    """
+    # cheap checks first: find_spec searches sys.path (and imports parent packages)
+    if dotpath in _builtin_module_names or sys.modules.get(dotpath) is not None:
+        return True
     try:
         spec = importlib.util.find_spec(dotpath)
         if spec is not None:
@@ -1,4 +1,7 @@
+import warnings
 from string import Formatter
+from functools import lru_cache
+from graphlib import TopologicalSorter, CycleError
 import json
 
 dflt_formatter = Formatter()
@@ -33,30 +36,81 @@ def increment_version(version_str):
     return '.'.join(map(str, version_nums))
 
 
+import re
+import gzip
+import urllib.error
 import urllib.request
 
-DLFT_PYPI_PACKAGE_JSON_URL_TEMPLATE = 'https://pypi.python.org/pypi/{package}/json'
+DLFT_PYPI_PACKAGE_JSON_URL_TEMPLATE = 'https://pypi.org/pypi/{package}/json'
+
+# url -> (etag, version) of the last responses, so we only download what changed
+_pypi_version_of_etag = {}
+
+try:
+    from packaging.version import Version, InvalidVersion
+except ModuleNotFoundError:
+    Version = None
+
+
+def version_sort_key(version_str):
+    """A key to sort version strings by, which (unlike the strings themselves) puts
+    '0.10.0' after '0.9.0'. Uses ``packaging`` (if installed) to order pre-releases right.
+
+    >>> max(['0.9.0', '0.10.0', '0.2.1'], key=version_sort_key)
+    '0.10.0'
+    """
+    if Version is not None:
+        try:
+            return (1, Version(version_str))
+        except InvalidVersion:
+            pass  # fall back to comparing the numbers of the version
+    return (0, tuple(map(int, re.findall(r'\d+', version_str))))
+
+
+def _last_version_of_pypi_json(t):
+    version = t.get('info', {}).get('version')
+    if version:
+        return version
+    releases = t.get('releases', [])
+    if releases:
+        return max(releases, key=version_sort_key)
 
 
 def get_last_pypi_version_number(package: str, url_template=DLFT_PYPI_PACKAGE_JSON_URL_TEMPLATE) -> str:
     """
-    Return version of package on pypi.python.org using json.
+    Return version of package on pypi.org using json.
 
     ```
     > get_version('tec')
     '0.0.7'
     ```
 
+    The json is asked for gzipped, and if we already asked for that url, only if it changed
+    since (if not, the version we got then is returned).
+
     :param package: Name of the package
     :return: A version (string
     """
-    req = urllib.request.Request(url_template.format(package=package))
-    r = urllib.request.urlopen(req)
+    url = url_template.format(package=package)
+    headers = {'Accept-Encoding': 'gzip'}
+    if url in _pypi_version_of_etag:
+        headers['If-None-Match'] = _pypi_version_of_etag[url][0]
+    req = urllib.request.Request(url, headers=headers)
+    try:
+        r = urllib.request.urlopen(req)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:  # not modified
+            return _pypi_version_of_etag[url][1]
+        raise
     if r.code == 200:
-        t = json.loads(r.read())
-        releases = t.get('releases', [])
-        if releases:
-            return sorted(releases)[-1]
+        content = r.read()
+        if r.headers.get('Content-Encoding') == 'gzip':
+            content = gzip.decompress(content)
+        version = _last_version_of_pypi_json(json.loads(content))
+        etag = r.headers.get('ETag')
+        if etag:
+            _pypi_version_of_etag[url] = (etag, version)
+        return version
 
 
 def next_version_for_package(package: str, url_template=DLFT_PYPI_PACKAGE_JSON_URL_TEMPLATE) -> str:
@@ -96,12 +150,16 @@ def ujoin(*args):
     ''
     >>> ujoin()
     ''
+
+    Empty tokens (after the first) are ignored
+    >>> ujoin('https://pypi.org', '', 'project')
+    'https://pypi.org/project'
     """
     if len(args) == 0 or len(args[0]) == 0:
         return ''
-    return ((args[0][0] == '/') * '/'  # prepend slash if first arg starts with it
-            + '/'.join(x[(x[0] == '/'):(len(x) - (x[-1] == '/'))] for x in args)
-            + (args[-1][-1] == '/') * '/')  # append slash if last arg ends with it
+    return (('/' if args[0].startswith('/') else '')  # prepend slash if first arg starts with it
+            + '/'.join(x.strip('/') for x in args if x)
+            + ('/' if args[-1].endswith('/') else ''))  # append slash if last arg ends with it
 
 
 ########### Partial and incremental formatting #########################################################################
@@ -124,25 +182,25 @@ class PartialFormatter(Formatter):
 partial_formatter = PartialFormatter()
 
 
-# TODO: For those who love algorithmic optimization, there's some wasted to cut out here below.
-
-def _unformatted(d):
-    for k, v in d.items():
-        if isinstance(v, str) and len(partial_formatter.format_fields_set(v)) > 0:
-            yield k
+@lru_cache(maxsize=1024)
+def format_fields_set(s):
+    """The (frozen)set of the names of the format fields of s, cached since
+    the same templates get parsed over and over in format_str_vals_of_dict"""
+    return frozenset(partial_formatter.format_fields_set(s))
 
 
 def _fields_to_format(d):
     for k, v in d.items():
         if isinstance(v, str):
-            yield from partial_formatter.format_fields_set(v)
+            yield from format_fields_set(v)
 
 
-def format_str_vals_of_dict(d, *, max_formatting_loops=10, **kwargs):
+def format_str_vals_of_dict(d, *, max_formatting_loops=None, **kwargs):
     """
 
     :param d:
-    :param max_formatting_loops:
+    :param max_formatting_loops: Deprecated (and ignored): values are now formatted in
+        the order of their dependencies, so no formatting loops are needed
     :param kwargs:
     :return:
 
@@ -182,6 +240,21 @@ def format_str_vals_of_dict(d, *, max_formatting_loops=10, **kwargs):
 
     # TODO: Could make the above work if filename is give, but not file nor ext! At least as an option.
 
+    Values given as kwargs can have fields too (and those need to be provided as well)
+    >>> format_str_vals_of_dict({'a': '{k}', 'b': 'B'}, k='{b}')
+    {'a': 'B', 'b': 'B'}
+    >>> format_str_vals_of_dict({'a': '{k}'}, k='{b}')
+    Traceback (most recent call last):
+    ...
+    ValueError: I won't be able to complete that. You'll need to provide the values for:
+      b
+
+    Fields referring to each other can't be formatted though.
+    >>> format_str_vals_of_dict({'a': '{b}', 'b': 'x{a}'})
+    Traceback (most recent call last):
+    ...
+    ValueError: There are some fields that refer to each other, so will never get formatted: ['a', 'b', 'a']
+
     """
     d = dict(**d)  # make a shallow copy
     # The defaults (kwargs) cannot overlap with any keys of d, so:
@@ -194,17 +267,36 @@ def format_str_vals_of_dict(d, *, max_formatting_loops=10, **kwargs):
         raise ValueError("I won't be able to complete that. You'll need to provide the values for:\n" +
                          f"  {', '.join(missing_fields)}")
 
-    for i in range(max_formatting_loops):
-        unformatted = set(_unformatted(d))
-
-        if unformatted:
-            for k in unformatted:
-                d[k] = partial_formatter.format(d[k], **kwargs, **d)
-        else:
-            break
-    else:
-        raise ValueError(f"There are still some unformatted fields, "
-                         f"but I reached my max {max_formatting_loops} allowed loops. " +
-                         f"Those fields are: {set(_fields_to_format(d)) - (set(d) | set(kwargs))}")
-
+    if max_formatting_loops is not None:
+        warnings.warn(
+            'max_formatting_loops is deprecated, and ignored: values are formatted once, '
+            'in the order of their dependencies',
+            DeprecationWarning,
+            stacklevel=2,
+        )
+
+    # Format each value once, after the values it refers to have been formatted.
+    # The values of kwargs can refer to fields too, so are part of the graph (only those
+    # the values of d (indirectly) refer to, since only those are used).
+    values = {**kwargs, **d}
+    dependencies = {}
+    keys_to_visit = list(d)
+    for k in keys_to_visit:  # (a list that grows as we go)
+        if k not in dependencies and isinstance(values.get(k), str):
+            dependencies[k] = format_fields_set(values[k]) & values.keys()
+            keys_to_visit.extend(dependencies[k])
+    try:
+        formatting_order = list(TopologicalSorter(dependencies).static_order())
+    except CycleError as e:
+        raise ValueError(f"There are some fields that refer to each other, "
+                         f"so will never get formatted: {e.args[1]}")
+    for k in formatting_order:
+        if k in dependencies and format_fields_set(values[k]):
+            values[k] = partial_formatter.format(values[k], **values)
+
+    d = {k: values[k] for k in d}
+    still_missing_fields = set(_fields_to_format(d))
+    if still_missing_fields:
+        raise ValueError("I won't be able to complete that. You'll need to provide the values for:\n" +
+                         f"  {', '.join(sorted(still_missing_fields))}")
     return d
@@ -13,64 +13,169 @@ Note: Assumes these packages are in the format:
             ...
 """
 
+import os
+import time
 from functools import lru_cache
-from dol import filt_iter, wrap_kvs, Pipe, cache_iter
-from dol.filesys import FileCollection
 from pathlib import Path
-from dol.filesys import DirCollection
+from itertools import repeat
+from concurrent.futures import ThreadPoolExecutor
+
+from tec.util import DFLT_MAX_WORKERS  # (listing folders is blocking I/O, so threads help)
+
+# Number of seconds cached project roots are trusted for (the filesystem changes)
+DFLT_CACHE_TTL = 30
+# Names of folders that don't contain projects, and are often huge, so aren't walked
+DFLT_SKIP_DIRNAMES = frozenset(
+    {
+        '.git',
+        'node_modules',
+        '__pycache__',
+        '.venv',
+        'venv',
+        '.tox',
+        'build',
+        'dist',
+        '.mypy_cache',
+        '.pytest_cache',
+        'site-packages',
+    }
+)
 
 
 def dir_whose_parent_has_same_name(k):
-    path = Path(k)
-    return path.is_dir() and path.parent.name == path.name
+    parent, name = os.path.split(k.rstrip(os.path.sep))
+    return os.path.basename(parent) == name and os.path.isdir(k)
 
 
 def folder_has_init(path):
-    return (Path(path) / '__init__.py').is_file()
+    return os.path.isfile(os.path.join(path, '__init__.py'))
 
 
 def package_directory_of_project_root(path):
-    path = Path(path)
-    return str(path / path.name)
+    path = os.fspath(path).rstrip(os.path.sep)
+    return os.path.join(path, os.path.basename(path))
 
 
 def is_project_root(path):
-    path = Path(path)
     code_root = package_directory_of_project_root(path)
-    return folder_has_init(code_root) and (path / 'setup.cfg').is_file()
+    return folder_has_init(code_root) and os.path.isfile(os.path.join(path, 'setup.cfg'))
 
 
 def is_package_directory(path):
-    path = Path(path)
     return folder_has_init(path)
 
 
+def _subdir_names(dirpath, skip_dirs=DFLT_SKIP_DIRNAMES):
+    """Names of the (non-hidden, non-symlink, not in skip_dirs) subfolders of dirpath.
+    Uses os.scandir, whose entries know if they're folders without an extra stat call.
+    """
+    try:
+        with os.scandir(dirpath) as entries:
+            return [
+                entry.name
+                for entry in entries
+                if not entry.name.startswith('.')
+                and entry.name not in skip_dirs
+                and entry.is_dir(follow_symlinks=False)
+            ]
+    except OSError:  # e.g. no permission to list the folder
+        return []
+
+
+def _iter_package_root_dirs(
+    rootdir,
+    max_levels=None,
+    only_if_has_init=False,
+    max_workers=DFLT_MAX_WORKERS,
+    skip_dirs=DFLT_SKIP_DIRNAMES,
+):
+    """Generator of (project_root, package_dir) pairs found under rootdir, where
+    package_dir is the subfolder of project_root that has the same name.
+
+    Hidden folders, and those whose name is in ``skip_dirs``, are neither considered
+    nor walked. ``max_levels`` has the meaning it has in
+    ``dol.filesys.DirCollection`` (package_dir can be at most ``max_levels + 1``
+    levels under rootdir).
+
+    The folders are walked breadth-first, the folders of each level being listed
+    concurrently by ``max_workers`` threads. The walk doesn't descend into the project
+    roots it finds (so a package's subpackages are never listed).
+    """
+    rootdir = rootdir.rstrip(os.path.sep) or os.path.sep
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        level, dirpaths = 0, [rootdir]
+        while dirpaths:
+            next_level_dirpaths = []
+            for dirpath, subdir_names in zip(
+                dirpaths, executor.map(_subdir_names, dirpaths, repeat(skip_dirs))
+            ):
+                name = os.path.basename(dirpath)
+                if name in subdir_names:
+                    package_dir = os.path.join(dirpath, name)
+                    if not only_if_has_init or folder_has_init(package_dir):
+                        yield dirpath, package_dir
+                        continue  # no need to look for projects inside a project
+                if max_levels is None or level < max_levels:  # else would be too deep
+                    next_level_dirpaths.extend(
+                        os.path.join(dirpath, subdir_name) for subdir_name in subdir_names
+                    )
+            level, dirpaths = level + 1, next_level_dirpaths
+
+
 # TODO: package_root_dirs and root_dirpaths_to_packages were writte before
 #  is_package_directory and is_project_root, so refactor might be in order
-def package_root_dirs(rootdir, max_levels=None, only_if_has_init=False):
-    if only_if_has_init:
-        init_filt = filt_iter(filt=lambda p: (Path(p) / '__init__.py').is_file())
-    else:
-        init_filt = lambda x: x
-    S = Pipe(
-        filt_iter(DirCollection, filt=dir_whose_parent_has_same_name),
-        init_filt,
-        wrap_kvs(
-            key_of_id=lambda x: str(Path(x).parent),
-            id_of_key=lambda x: str(Path(x) / Path(x).name),
-        ),
-        cache_iter,
+def package_root_dirs(
+    rootdir,
+    max_levels=None,
+    only_if_has_init=False,
+    max_workers=DFLT_MAX_WORKERS,
+    skip_dirs=DFLT_SKIP_DIRNAMES,
+):
+    """A ``{project_root: package_dir, ...}`` dict of the project roots under rootdir,
+    where a project root is a folder containing a folder of the same name (the
+    package directory)."""
+    return dict(
+        _iter_package_root_dirs(
+            rootdir,
+            max_levels,
+            only_if_has_init=only_if_has_init,
+            max_workers=max_workers,
+            skip_dirs=skip_dirs,
+        )
     )
-    return S(rootdir, max_levels=max_levels)
 
 
-@lru_cache
-def root_dirpaths_to_packages(rootdir, max_levels=None, only_if_has_init=False):
+@lru_cache(maxsize=64)
+def _root_dirpaths_to_packages(
+    rootdir, max_levels, only_if_has_init, skip_dirs, _time_bucket
+):
     return list(
-        package_root_dirs(rootdir, max_levels, only_if_has_init=only_if_has_init)
+        package_root_dirs(
+            rootdir, max_levels, only_if_has_init=only_if_has_init, skip_dirs=skip_dirs
+        )
+    )
+
+
+def root_dirpaths_to_packages(
+    rootdir, max_levels=None, only_if_has_init=False, skip_dirs=DFLT_SKIP_DIRNAMES
+):
+    """List of the project roots under rootdir (see ``package_root_dirs``).
+
+    Results are cached for (at most) ``DFLT_CACHE_TTL`` seconds, since the folders
+    change. Call ``root_dirpaths_to_packages.cache_clear()`` to forget them sooner.
+    """
+    return _root_dirpaths_to_packages(
+        rootdir,
+        max_levels,
+        only_if_has_init,
+        frozenset(skip_dirs),  # (a hashable version of it, for the cache key)
+        int(time.monotonic() // DFLT_CACHE_TTL),  # changes every DFLT_CACHE_TTL seconds
     )
 
 
+root_dirpaths_to_packages.cache_clear = _root_dirpaths_to_packages.cache_clear
+
+
 Packages = package_root_dirs  # backcomp alias
 
 
@@ -90,7 +195,8 @@ def init_file_of_pkg_root(root):
 def is_package_init(k):
     if not k.endswith('__init__.py'):
         return False
-    path = Path(k)
-    parent = path.parent
-    grandparent = parent.parent
-    return parent.name == grandparent.name and (grandparent / 'setup.py').is_file()
+    parent = os.path.dirname(k)
+    grandparent, parent_name = os.path.split(parent)
+    return os.path.basename(grandparent) == parent_name and os.path.isfile(
+        os.path.join(grandparent, 'setup.py')
+    )
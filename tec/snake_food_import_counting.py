@@ -2,13 +2,20 @@ import inspect
 import os
 import re
 import subprocess
+import time
 from collections import Counter
-from io import StringIO
+from functools import lru_cache
 
 import pandas as pd
-from numpy import unique
+
+from tec.pkg_code import DFLT_CACHE_TTL
 
 file_sep = os.path.sep
+# Folders the file walkers don't go into (on top of hidden ones): they have no source
+# files. (Unlike project discovery, these walks don't skip build, dist etc.: those can
+# be actual subpackages.)
+DFLT_WALK_SKIP_DIRNAMES = frozenset({'__pycache__'})
+word_p = re.compile(r'\w+')
 
 
 def imports_in_module(module):
@@ -44,6 +51,41 @@ def imports_in_module(module):
     return [x for x in t.split('\n') if len(x) > 0]
 
 
+sfood_import_line_p = re.compile(r'^(.+):\d+:\s*(\S+)\s*$')
+# max number of files to give a single sfood-imports call (to stay clear of ARG_MAX)
+SFOOD_BATCH_SIZE = 512
+
+
+def imports_in_modules(filepaths):
+    """
+    Get a {filepath: imports, ...} dict, where imports is the list of strings showing what is imported
+    in the module of filepath (as imports_in_module would), for all filepaths.
+    Unlike calling imports_in_module on each file, sfood-imports is only called once per batch of
+    SFOOD_BATCH_SIZE files.
+
+    Note: Requires having snakefood installed:
+    http://furius.ca/snakefood/doc/snakefood-doc.html#installation
+    """
+    filepaths = list(filepaths)
+    imports = {filepath: [] for filepath in filepaths}
+    for i in range(0, len(filepaths), SFOOD_BATCH_SIZE):
+        t = subprocess.check_output(
+            ['sfood-imports'] + filepaths[i:i + SFOOD_BATCH_SIZE], universal_newlines=True
+        )
+        for line in t.splitlines():
+            m = sfood_import_line_p.match(line)
+            if m is not None:
+                filepath, imported = m.groups()
+                file_imports = imports.setdefault(filepath, [])
+                if imported not in file_imports:
+                    file_imports.append(imported)
+    return imports
+
+
+def _base_modules(imports):
+    return sorted({m.group(0) for m in map(word_p.match, imports) if m})
+
+
 def base_modules_used_in_module(module):
     """
     Get a list of strings showing what base modules that are imported in a module.
@@ -56,7 +98,7 @@ def base_modules_used_in_module(module):
     >>> base_modules_used_in_module(__file__)  # doctest: +SKIP
     ['StringIO', 'collections', 'inspect', 'numpy', 'os', 'pandas', 're', 'subprocess', 'ut']
     """
-    return list(unique([re.compile('\w+').findall(x)[0] for x in imports_in_module(module)]))
+    return _base_modules(imports_in_module(module))
 
 
 def base_module_imports_in_module_recursive(module):
@@ -84,17 +126,13 @@ def base_module_imports_in_module_recursive(module):
         module = os.path.dirname(module)
 
     if os.path.isdir(module):
+        try:
+            imports_of_module = imports_in_modules(py_filepaths_under_folder(module))
+        except FileNotFoundError:
+            raise RuntimeError("You don't have sfood-imports installed (snakefood), so I can't do my job")
         c = Counter()
-        it = get_filepath_iterator(module, pattern='.py$')
-        next(it)  # to skip the seed module itself, and not get into an infinite loop
-        for _module in it:
-            try:
-                c.update(base_module_imports_in_module_recursive(_module))
-            except Exception as e:
-                if 'sfood-imports' in e.args[1]:
-                    raise RuntimeError("You don't have sfood-imports installed (snakefood), so I can't do my job")
-                else:
-                    print(("Error with module {}: {}".format(_module, e)))
+        for imports in imports_of_module.values():
+            c.update(_base_modules(imports))
         return c
     elif not os.path.isfile(module):
         raise ValueError("module file not found: {}".format(module))
@@ -105,6 +143,9 @@ def base_module_imports_in_module_recursive(module):
     # return Counter(map(lambda x: x[1:], unique(module_names.findall(module_contents))))
 
 
+requirement_name_p = re.compile('^[^=]+')
+
+
 def requirements_packages_in_module(module, requirements=None):
     if requirements is None:
         requirements = list(pip_licenses_df(include_module_name=False)['package_name'])
@@ -112,11 +153,10 @@ def requirements_packages_in_module(module, requirements=None):
         with open(requirements) as fp:
             requirements = fp.read().splitlines()
 
-    p = re.compile('^[^=]+')
     module_names = list()
     for x in requirements:
         try:
-            xx = p.findall(x)
+            xx = requirement_name_p.findall(x)
             if xx:
                 module_name = get_module_name(xx[0])
                 module_names.append(module_name)
@@ -126,24 +166,17 @@ def requirements_packages_in_module(module, requirements=None):
     return base_module_imports_in_module_recursive(module, module_names=requirements)
 
 
-word_or_letter_p = re.compile('\w')
-at_least_two_spaces_p = re.compile('\s{2,}')
-
-
 def pip_licenses_df(package_names=None, include_module_name=True, on_module_search_error=None):
     """
     Get a dataframe of pip packages and licences
     :return:
     """
-    pip_licenses_output = subprocess.check_output(['pip-licenses'])
-
-    t = list(map(str.strip,
-                 list(filter(word_or_letter_p.search,
-                             pip_licenses_output.split('\n')))))
-    t = [at_least_two_spaces_p.sub('\t', x) for x in t]
-    t = '\n'.join(t)
-
-    df = pd.read_csv(StringIO(t), sep='\t')
+    # let pandas parse the (csv) output straight from the pipe
+    with subprocess.Popen(['pip-licenses', '--format=csv'], stdout=subprocess.PIPE,
+                          universal_newlines=True) as proc:
+        df = pd.read_csv(proc.stdout)
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, proc.args)
     df = df.rename(columns={'Name': 'package_name', 'Version': 'version', 'License': 'license'})
     if include_module_name:
         df['module'] = [get_module_name(x, on_error=on_module_search_error) for x in df['package_name']]
@@ -156,20 +189,35 @@ def pip_licenses_df(package_names=None, include_module_name=True, on_module_sear
 def get_filepath_iterator(root_folder,
                           pattern='',
                           return_full_path=True,
-                          apply_pattern_to_full_path=False):
+                          apply_pattern_to_full_path=False,
+                          skip_dirs=DFLT_WALK_SKIP_DIRNAMES):
     if apply_pattern_to_full_path:
-        return recursive_file_walk_iterator_with_name_filter(root_folder, pattern, return_full_path)
+        return recursive_file_walk_iterator_with_name_filter(root_folder, pattern, return_full_path, skip_dirs)
     else:
-        return recursive_file_walk_iterator_with_filepath_filter(root_folder, pattern, return_full_path)
+        return recursive_file_walk_iterator_with_filepath_filter(root_folder, pattern, return_full_path, skip_dirs)
 
 
-def iter_relative_files_and_folder(root_folder):
-    from glob import iglob
-    if not root_folder.endswith(file_sep):
-        root_folder += file_sep
-    return map(lambda x: x.replace(root_folder, ''), iglob(root_folder + '*'))
+@lru_cache(maxsize=64)
+def _py_filepaths_under_folder(folder, _time_bucket):
+    return tuple(get_filepath_iterator(folder, pattern='.py$'))
 
 
+def py_filepaths_under_folder(folder):
+    """Tuple of the .py files under folder, shared by the analyses of that folder.
+
+    Like ``tec.pkg_code.root_dirpaths_to_packages``, the listing is cached for (at most)
+    ``DFLT_CACHE_TTL`` seconds, since files come and go.
+    Call ``py_filepaths_under_folder.cache_clear()`` to forget it sooner.
+    """
+    return _py_filepaths_under_folder(
+        folder, int(time.monotonic() // DFLT_CACHE_TTL)  # changes every DFLT_CACHE_TTL s
+    )
+
+
+py_filepaths_under_folder.cache_clear = _py_filepaths_under_folder.cache_clear
+
+
+@lru_cache(maxsize=128)
 def pattern_filter(pattern):
     pattern = re.compile(pattern)
 
@@ -179,37 +227,34 @@ def pattern_filter(pattern):
     return _pattern_filter
 
 
-def recursive_file_walk_iterator_with_name_filter(root_folder, filt='', return_full_path=True):
+def _walk_files(root_folder, filt, return_full_path, apply_filt_to_full_path, skip_dirs):
+    """Iteratively (with a stack of folders, not recursive calls) walk the (non-hidden)
+    files under root_folder, yielding those whose path (or name) satisfies filt.
+    Folders whose name is in skip_dirs, and symlinks to folders, aren't walked."""
     if isinstance(filt, str):
         filt = pattern_filter(filt)
-    # if isinstance(pattern, basestring):
-    #     pattern = re.compile(pattern)
-    for name in iter_relative_files_and_folder(root_folder):
-        full_path = os.path.join(root_folder, name)
-        if os.path.isdir(full_path):
-            for entry in recursive_file_walk_iterator_with_name_filter(full_path, filt, return_full_path):
-                yield entry
-        else:
-            if os.path.isfile(full_path):
-                if filt(name):
-                    if return_full_path:
-                        yield full_path
-                    else:
-                        yield name
-
-
-def recursive_file_walk_iterator_with_filepath_filter(root_folder, filt='', return_full_path=True):
-    if isinstance(filt, str):
-        filt = pattern_filter(filt)
-    for name in iter_relative_files_and_folder(root_folder):
-        full_path = os.path.join(root_folder, name)
-        if os.path.isdir(full_path):
-            for entry in recursive_file_walk_iterator_with_filepath_filter(full_path, filt, return_full_path):
-                yield entry
-        else:
-            if os.path.isfile(full_path):
-                if filt(full_path):
-                    if return_full_path:
-                        yield full_path
-                    else:
-                        yield name
+    stack = [root_folder]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in skip_dirs:
+                            stack.append(entry.path)
+                    elif entry.is_file():
+                        if filt(entry.path if apply_filt_to_full_path else entry.name):
+                            yield entry.path if return_full_path else entry.name
+        except OSError:  # e.g. no permission to list the folder
+            continue
+
+
+def recursive_file_walk_iterator_with_name_filter(root_folder, filt='', return_full_path=True,
+                                                  skip_dirs=DFLT_WALK_SKIP_DIRNAMES):
+    return _walk_files(root_folder, filt, return_full_path, False, skip_dirs)
+
+
+def recursive_file_walk_iterator_with_filepath_filter(root_folder, filt='', return_full_path=True,
+                                                      skip_dirs=DFLT_WALK_SKIP_DIRNAMES):
+    return _walk_files(root_folder, filt, return_full_path, True, skip_dirs)
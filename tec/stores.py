@@ -1,65 +1,416 @@
 """(dol) stores (i.e. mapping interfaces) to access python files"""
+import os
 import re
-from xdol.pystores import PyFilesReader, builtins_py_files, sitepackages_py_files
+import shutil
+import subprocess
+from collections import OrderedDict
+from collections.abc import Mapping
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from dol import KvReader, cached_keys, wrapped_self
+from dol.filesys import FileBytesReader
+from xdol.pystores import py_files_wrap, builtins_rootdir, sitepackages_rootdir
+from xdol.pystores import PkgReader as _XdolPkgReader
+from tec.util import (
+    resolve_to_folder,
+    decode_or_default,
+    iter_py_filepaths,
+    DFLT_MAX_WORKERS,
+)
 
-commented_header_re = re.compile("(\"\"\"|''')\s?.+")
-triple_quotes_re = re.compile("\"\"\"|'''")
-triple_quotes_ending_re = re.compile("\"\"\"$|'''$")
+# a line starting with triple quotes, capturing the rest of it (or the next line, if the
+# rest of it is blank)
+docstring_head_re = re.compile(r"^(?:\"\"\"|''')(?:[ \t\r\f\v]*\n)?(.*)", re.MULTILINE)
 
 
-def _clean_str(string):
-    return triple_quotes_re.sub("", string.strip())
+def _scandir_filepaths(dirpath, max_levels, include_hidden, skip_dirnames, _level=0):
+    """Recursively generate the filepaths under dirpath, as ``dol.filesys`` does, but
+    with ``os.scandir``, whose entries know if they're files or folders without a stat"""
+    try:
+        with os.scandir(dirpath) as entries:
+            entries = list(entries)
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        return
+    for entry in entries:
+        if not include_hidden and entry.name.startswith("."):
+            continue
+        if entry.is_dir():
+            if _level < max_levels and entry.name not in skip_dirnames:
+                yield from _scandir_filepaths(
+                    entry.path, max_levels, include_hidden, skip_dirnames, _level + 1
+                )
+        elif entry.is_file():
+            yield entry.path
+
+
+class ScandirFileBytesReader(FileBytesReader):
+    """A ``FileBytesReader`` listing its files with ``os.scandir`` (``dol`` uses
+    ``os.listdir``, then stats every entry), and not walking folders named in
+    ``skip_dirnames``."""
+
+    skip_dirnames = frozenset()
+
+    def __iter__(self):
+        return filter(
+            self.is_valid_key,
+            _scandir_filepaths(
+                self.rootdir, self._max_levels, self.include_hidden, self.skip_dirnames
+            ),
+        )
+
+
+@py_files_wrap
+class PyFilesReader(ScandirFileBytesReader, KvReader):
+    """Mapping interface to .py files of a folder.
+    Keys are relative .py paths.
+    Values are the string contents of the .py file.
+
+    Same as ``xdol.pystores.PyFilesReader``, but lists its files faster.
+
+    >>> import asyncio
+    >>> from xdol.pystores import PyFilesReader as XdolPyFilesReader
+    >>> s = PyFilesReader(asyncio)
+    >>> list(s) == list(XdolPyFilesReader(asyncio))
+    True
+    >>> s.is_pkg()
+    True
+    """
+
+    skip_dirnames = frozenset({"__pycache__"})  # has no .py files
+
+    def __init__(self, src, *, max_levels=None):
+        super().__init__(rootdir=resolve_to_folder(src), max_levels=max_levels)
+
+    def init_file_contents(self):
+        """Returns the string of contents of the __init__.py file if it exists, and None if not"""
+        return wrapped_self(self).get("__init__.py", None)
+
+    def is_pkg(self):
+        """Returns True if, and only if, the root is a pkg folder (i.e. has an __init__.py file)"""
+        # one stat, without going through the layers of key (relative path) wrapping
+        return os.path.isfile(os.path.join(self.rootdir, "__init__.py"))
+
+
+class PkgReader(_XdolPkgReader):
+    """Same as ``xdol.PkgReader``, but its values are (tec's) ``PyFilesReader`` stores,
+    each made (and its folder resolved) only once per key.
+    (The stores read the files when asked to, so their contents are never stale.)
+
+    >>> import asyncio, os
+    >>> s = PkgReader(os.path.dirname(os.path.dirname(asyncio.__file__)))
+    >>> s['asyncio'] is s['asyncio']
+    True
+    >>> s['asyncio'].is_pkg()
+    True
+    """
+
+    def __init__(self, rootdir, *args, **kwargs):
+        super().__init__(rootdir, *args, **kwargs)
+        self._child_cache = {}
+
+    def __getitem__(self, k):
+        try:
+            return self._child_cache[k]
+        except KeyError:
+            v = self._child_cache[k] = PyFilesReader(os.path.join(self.rootdir, k))
+            return v
+
+
+class LRUValueCache(Mapping):
+    """A read-only store wrapper that keeps the (at most maxsize) last values it got from
+    store in memory, so that getting them again doesn't read (and decode) them again.
+    Only use it on stores whose values don't change (or call ``cache_clear()``).
+
+    >>> s = LRUValueCache({'a': 1, 'b': 2, 'c': 3}, maxsize=2)
+    >>> s['a'], s['b'], s['c']
+    (1, 2, 3)
+    >>> list(s.cached_keys())  # 'a' was evicted, being the least recently used
+    ['b', 'c']
+    >>> sorted(s), len(s), 'a' in s
+    (['a', 'b', 'c'], 3, True)
+    """
+
+    def __init__(self, store, maxsize=256):
+        self.store = store
+        self.maxsize = maxsize
+        self._values = OrderedDict()
+
+    def __getitem__(self, k):
+        try:
+            self._values.move_to_end(k)
+            return self._values[k]
+        except KeyError:
+            v = self.store[k]
+            self._values[k] = v
+            if len(self._values) > self.maxsize:
+                self._values.popitem(last=False)
+            return v
+
+    def __iter__(self):
+        return iter(self.store)
+
+    def __len__(self):
+        return len(self.store)
+
+    def __contains__(self, k):
+        return k in self.store
+
+    def __getattr__(self, a):  # delegate the rest (e.g. rootdir) to the wrapped store
+        if a == "store":  # (not set yet, e.g. when unpickling)
+            raise AttributeError(a)
+        return getattr(self.store, a)
+
+    def cached_keys(self):
+        return self._values.keys()
+
+    def cache_clear(self):
+        self._values.clear()
+
+
+# The builtin and site-packages files don't change (much) during a session, so
+# repeatedly looked at modules are only read and decoded once.
+# These stores are only made when first asked for (see __getattr__ below).
+_lazy_py_files_rootdirs = {
+    "builtins_py_files": builtins_rootdir,
+    "sitepackages_py_files": sitepackages_rootdir,
+}
+
+
+# Regexes that aren't used anymore, only compiled if some (outside) code asks for them
+_unused_regex_patterns = {
+    "commented_header_re": "(\"\"\"|''')\\s?.+",
+    "triple_quotes_re": "\"\"\"|'''",
+    "triple_quotes_ending_re": "\"\"\"$|'''$",
+}
+
+
+def __getattr__(name):
+    if name in _lazy_py_files_rootdirs:
+        rootdir = _lazy_py_files_rootdirs[name]
+        obj = LRUValueCache(cached_keys(PyFilesReader(rootdir)), maxsize=256)
+    elif name in _unused_regex_patterns:
+        obj = re.compile(_unused_regex_patterns[name])
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = obj  # so __getattr__ isn't called for this name again
+    return obj
 
 
 def file_contents_to_short_description(file_contents: str, dflt=None, max_lines=4):
-    lines = file_contents.split("\n")
-    quotes_line_idx = next(
-        (i for i, line in enumerate(lines[:max_lines]) if triple_quotes_re.match(line)),
-        None,
-    )
-    if quotes_line_idx is not None:
-        i = quotes_line_idx
-        first_line_of_description = lines[i][3:].strip()
-        if first_line_of_description:
-            return _clean_str(first_line_of_description)
-        i = min(len(lines), quotes_line_idx + 1)
-        first_line_of_description = lines[i].strip()
-        if first_line_of_description:
-            return _clean_str(first_line_of_description)
+    """The first line of the docstring, if file_contents starts with one
+    (that is, if one of its first max_lines lines starts with triple quotes).
+
+    >>> file_contents_to_short_description("'''Tools to inspect python objects.\\n\\nMore.'''")
+    'Tools to inspect python objects.'
+    >>> file_contents_to_short_description("#!/usr/bin/env python\\n'''\\n  A script\\n'''")
+    'A script'
+    >>> file_contents_to_short_description("import os", dflt="no description")
+    'no description'
+    >>> file_contents_to_short_description("'''A description'''", max_lines=0) is None
+    True
+    """
+    # go through the first lines (stopping at the docstring) without splitting them all
+    m = None
+    pos = 0
+    for _ in range(max_lines):
+        m = docstring_head_re.match(file_contents, pos)
+        if m is not None:
+            break
+        pos = file_contents.find("\n", pos) + 1
+        if pos == 0:  # there's no next line
+            break
+    if m is not None:
+        description = m.group(1).strip().replace('"""', "").replace("'''", "")
+        if description:
+            return description
     return dflt
-    # m = commented_header_re.match(file_contents)
-    # if m:
-    #     t = m.group(0)[3:].strip()
-    #     t = triple_quotes_ending_re.sub('', t)
-    #     return t
-    # else:
-    #     return dflt
-
-
-def find_short_description_for_pkg(s):
-    """Generator of (pkg_name, short_description) pairs (using the header comments of init files as description)"""
-    for k, v in s.items():
-        if k.endswith("__init__.py") and (v.startswith('"""') or v.startswith("'''")):
+
+
+def _chunks(items, chunksize):
+    return (items[i : i + chunksize] for i in range(0, len(items), chunksize))
+
+
+def _thread_map(func, iterable, max_workers=DFLT_MAX_WORKERS, chunksize=1):
+    """Like map(func, iterable), but with func calls made concurrently by max_workers
+    threads (sequentially if max_workers is 1). Worth it when func blocks on I/O
+    (like reading files), which releases the GIL.
+
+    With a chunksize above 1, the threads are given chunks of (that many) items at a
+    time, which amortizes the (tens of microseconds) cost of handing out each task.
+
+    >>> list(_thread_map(str.upper, 'abcde', max_workers=2, chunksize=2))
+    ['A', 'B', 'C', 'D', 'E']
+    """
+    if max_workers == 1:
+        yield from map(func, iterable)
+        return
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        if chunksize == 1:
+            yield from executor.map(func, iterable)
+        else:
+            map_chunk = partial(_map_list, func)
+            for results in executor.map(map_chunk, _chunks(list(iterable), chunksize)):
+                yield from results
+    finally:  # (if we stop early, don't wait for the pending calls)
+        executor.shutdown(cancel_futures=True)
+
+
+def _map_list(func, items):
+    return [func(x) for x in items]
+
+
+def _docstring_head_of_file(filepath, max_bytes=4096):
+    """The (decoded) first max_bytes bytes of the file if it starts with a docstring,
+    and None if not (without decoding those that don't)"""
+    with open(filepath, "rb") as fp:
+        head = fp.read(max_bytes)
+    if not head.startswith((b'"""', b"'''")):
+        return None
+    if len(head) == max_bytes:  # don't cut a (multi-byte) character in two
+        head = head[: head.rfind(b"\n") + 1] or head
+    return decode_or_default(head, dflt=None)
+
+
+def find_short_description_for_pkg(s, max_workers=DFLT_MAX_WORKERS):
+    """Generator of (pkg_name, short_description) pairs (using the header comments of init files as description)
+
+    Only the init files' contents are read, by ``max_workers`` threads. If s has a
+    ``rootdir`` (like ``PyFilesReader`` stores), only the head bytes of the files are
+    read, and only decoded if they start with a docstring.
+    """
+    init_keys = [k for k in s if k.endswith("__init__.py")]
+    rootdir = getattr(s, "rootdir", None)
+
+    def head_of(k):
+        if rootdir is not None:
+            return _docstring_head_of_file(os.path.join(rootdir, k))
+        v = s[k]
+        return v if v.startswith(('"""', "'''")) else None
+
+    for k, v in zip(init_keys, _thread_map(head_of, init_keys, max_workers)):
+        if v is not None:
             k = k[: -(len("__init__.py") + 1)]
             yield k, file_contents_to_short_description(v)
 
 
-def py_files_with_contents_matching_pattern(files_src, pattern):
+_regex_special_chars = frozenset(".^$*+?{}[]\\|()\n")
+
+
+def _is_literal(pattern):
+    return isinstance(pattern, str) and _regex_special_chars.isdisjoint(pattern)
+
+
+def _rg_py_files_containing(rootdir, string):
+    """List of the (relative) paths of the .py files under rootdir containing string,
+    found by ripgrep, or None if ripgrep isn't installed (or failed)"""
+    rg = shutil.which("rg")
+    if rg is None:
+        return None
+    # also search the (.gitignored...) files rg skips by default, but not hidden ones,
+    # as our walk does
+    cmd = [rg, "--no-config", "--files-with-matches", "--fixed-strings", "--no-ignore"]
+    cmd += ["--no-messages", "--glob", "*.py", "--", string, rootdir]
+    r = subprocess.run(cmd, capture_output=True)
+    if r.returncode not in (0, 1):  # 1 means no matches
+        return None
+    return [os.path.relpath(p, rootdir) for p in os.fsdecode(r.stdout).splitlines()]
+
+
+# a \u, \U or \N escape (i.e. one not preceded by an escaped backslash)
+_unicode_escape_re = re.compile(r"(?<!\\)(?:\\\\)*\\[uUN]")
+
+
+def _has_bytes_equivalent(str_pattern):
+    """Whether the str regex means the same thing when utf-8 encoded into a bytes one
+    (not so if it has non-ascii characters (in a class, they'd be matched byte by byte)
+    or unicode escapes, which bytes patterns don't have)"""
+    return str_pattern.isascii() and not _unicode_escape_re.search(str_pattern)
+
+
+def _bytes_pattern(pattern):
+    """Compile pattern (string, bytes or re.Pattern) to a bytes pattern, to search
+    file bytes without decoding them (only for patterns with a bytes equivalent)"""
+    if isinstance(pattern, re.Pattern):
+        if isinstance(pattern.pattern, bytes):
+            return pattern
+        return re.compile(pattern.pattern.encode(), pattern.flags & ~re.UNICODE)
+    if isinstance(pattern, str):
+        pattern = pattern.encode()
+    return re.compile(pattern)
+
+
+def _bytes_matcher(pattern):
+    """A function telling if a bytes-like object matches pattern. Plain strings are
+    looked for as is (a C-level substring search), without going through a regex.
+    str patterns that don't have a bytes equivalent are searched for in the decoded
+    contents.
+
+    >>> matches = _bytes_matcher('[é-ë]')
+    >>> matches('café'.encode()), matches('Ã©'.encode())
+    (True, False)
+    >>> _bytes_matcher('\\\\u00e9')('café'.encode())
+    True
+    """
+    if _is_literal(pattern):
+        needle = pattern.encode()
+        return lambda buffer: buffer.find(needle) != -1
+    str_pattern = pattern.pattern if isinstance(pattern, re.Pattern) else pattern
+    if isinstance(str_pattern, str) and not _has_bytes_equivalent(str_pattern):
+        pattern = re.compile(pattern)
+        return lambda buffer: (
+            pattern.search(decode_or_default(bytes(buffer), dflt="")) is not None
+        )
+    pattern = _bytes_pattern(pattern)
+    return lambda buffer: pattern.search(buffer) is not None
+
+
+def _file_matches(filepath, matches):
+    """Whether the contents of the file match, or None if it couldn't be read.
+    (The file is read, not mmapped: read releases the GIL while waiting for the disk, but
+    a page fault in the middle of a (GIL holding) search doesn't.)"""
+    try:
+        with open(filepath, "rb") as fp:
+            return matches(fp.read())
+    except OSError:  # unreadable (or vanished) file
+        return None
+
+
+def py_files_with_contents_matching_pattern(
+    files_src, pattern, max_workers=DFLT_MAX_WORKERS
+):
     """Yields (relative) file paths of .py files whose contents match pattern.
 
     :param files_src: Source of files. Module, package, folder, or __init__.py file.
-    :param pattern: regular expression (string or re.Pattern object)
+    :param pattern: regular expression (string, bytes or re.Pattern object)
+
+    The files are read (by ``max_workers`` threads) and searched as bytes, so a str
+    pattern is utf-8 encoded, and character classes like ``\\w`` only match ASCII.
+    (Except for str patterns with non-ascii characters or ``\\u``, ``\\U``, ``\\N``
+    escapes: those are searched for in the decoded contents.)
+    If pattern is a plain string (no regex special characters), and ripgrep (``rg``)
+    is installed, the (much faster) ripgrep is used to do the search.
 
     Let's see what modules of asyncio contain the "import io" string:
 
     >>> import asyncio
     >>> set(py_files_with_contents_matching_pattern(asyncio, 'import io')).issuperset(
     ...     {'proactor_events.py', 'unix_events.py'})
+    True
 
     """
 
-    pattern = re.compile(pattern)
-    s = PyFilesReader(files_src)
-    for k, v in s.items():
-        if pattern.search(v):
-            yield k
+    rootdir = resolve_to_folder(files_src)
+    if _is_literal(pattern):
+        filepaths = _rg_py_files_containing(rootdir, pattern)
+        if filepaths is not None:
+            yield from filepaths
+            return
+    matches = _bytes_matcher(pattern)
+    filepaths = list(iter_py_filepaths(rootdir))
+    file_matches = partial(_file_matches, matches=matches)
+    for filepath, is_match in zip(
+        filepaths, _thread_map(file_matches, filepaths, max_workers, chunksize=32)
+    ):
+        if is_match:
+            yield os.path.relpath(filepath, rootdir)
@@ -3,18 +3,30 @@
 import re
 import inspect
 import os
+from functools import lru_cache
+
+# Default number of threads for blocking filesystem I/O (listing folders, reading
+# files), which releases the GIL, so threads help, even well beyond the number of cores
+DFLT_MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+# Default (max) number of processes for CPU bound work (like parsing files): no more
+# than there are cores
+DFLT_MAX_PROCESSES = min(32, os.cpu_count() or 1)
 
 DFLT_USE_CCHARDET = True
 
 try:
     import cchardet as chardet
 except ModuleNotFoundError:
+    # The pure python chardet is too slow (can take seconds on big files) to be used by
+    # default, but can still be asked for explicitly (with use_cchardet=True)
+    DFLT_USE_CCHARDET = False
     try:
         import chardet
     except ModuleNotFoundError:
-        DFLT_USE_CCHARDET = False
+        chardet = None
 
-encoding_spec_re = re.compile(b"-*- coding: (.+) -*-")
+# PEP 263 encoding declaration (only valid in the first two lines of a file)
+encoding_spec_re = re.compile(rb"^[ \t\f]*#.*?coding[:=][ \t]*([-\w.]+)", re.MULTILINE)
 
 
 import operator
@@ -126,22 +138,36 @@ def _old_find_left_for_educational_purposes(
 
 
 def extract_encoding_from_contents(content_bytes: bytes):
-    r = encoding_spec_re.search(content_bytes)
+    """The encoding declared (PEP 263) in the first two lines of content_bytes, if any.
+
+    >>> extract_encoding_from_contents(b'#!/usr/bin/python\\n# -*- coding: latin-1 -*-\\n')
+    b'latin-1'
+    >>> extract_encoding_from_contents(b'import os\\n\\n# -*- coding: latin-1 -*-\\n')
+    """
+    end_of_second_line = content_bytes.find(b"\n", content_bytes.find(b"\n") + 1)
+    if end_of_second_line == -1:
+        end_of_second_line = len(content_bytes)
+    r = encoding_spec_re.search(content_bytes, 0, end_of_second_line)
     if r is not None:
         return r.group(1)
     else:
         return None
 
 
+def _detected_encoding(content_bytes: bytes):
+    """The encoding chardet detects (a statistical scan of all the bytes)"""
+    r = chardet.detect(content_bytes)
+    if r:
+        return r["encoding"]
+
+
 def get_encoding(content_bytes: bytes, use_cchardet=DFLT_USE_CCHARDET):
     extracted_encoding = extract_encoding_from_contents(content_bytes)
     if extracted_encoding is not None:
         return extracted_encoding.decode()
     else:
-        if use_cchardet:
-            r = chardet.detect(content_bytes)
-            if r:
-                return r["encoding"]
+        if use_cchardet and chardet is not None:
+            return _detected_encoding(content_bytes)
     return None  # if all else fails
 
 
@@ -151,31 +177,119 @@ decoding_problem_sentinel = "# --- did not manage to decode .py file bytes --- #
 def decode_or_default(
     b: bytes, dflt=decoding_problem_sentinel, use_cchardet=DFLT_USE_CCHARDET
 ):
+    """Decode b, as utf-8 if possible, else with the encoding it declares (PEP 263),
+    else with the one chardet detects (if use_cchardet), and return dflt if all that fails.
+
+    >>> decode_or_default('café'.encode())
+    'café'
+    >>> decode_or_default(b'# coding: latin-1\\n# caf\\xe9')
+    '# coding: latin-1\\n# café'
+    >>> decode_or_default(b'# coding: bogus\\n# caf\\xe9', 'failed', use_cchardet=False)
+    'failed'
+    """
+    # Note: No b.isascii() pre-check: ASCII is utf-8, which CPython decodes with an
+    # ASCII fast path, so such a check would only scan the bytes twice (and is slower).
     try:
         return b.decode()
     except UnicodeDecodeError:
-        encoding = get_encoding(b, use_cchardet=use_cchardet)
-        if encoding is not None:
-            return b.decode(encoding)
-        else:
-            return dflt
+        pass
+    declared_encoding = extract_encoding_from_contents(b)
+    if declared_encoding is not None:
+        try:
+            return b.decode(declared_encoding.decode())
+        except (UnicodeDecodeError, LookupError):  # wrong (or unknown) declared encoding
+            pass
+    if use_cchardet and chardet is not None:
+        detected_encoding = _detected_encoding(b)
+        if detected_encoding is not None:
+            try:
+                return b.decode(detected_encoding)
+            except (UnicodeDecodeError, LookupError):
+                pass
+    return dflt
 
 
 from xdol import (
-    # because it used to be defined here
-    resolve_to_folder,
-    resolve_module_filepath,
+    resolve_to_folder as _resolve_to_folder,
+    resolve_module_filepath as _resolve_module_filepath,
 )
 
 
+def _resolution_key(spec):
+    """The (string) path a module spec resolves from, or None if it has none (and
+    therefore can't be a cache key)"""
+    if isinstance(spec, str):
+        return spec
+    if inspect.ismodule(spec):
+        return inspect.getsourcefile(spec)  # (module objects are only hashable by id)
+    return None
+
+
+@lru_cache(maxsize=1024)
+def _cached_resolve_to_folder(key, assert_output_is_existing_folder):
+    return _resolve_to_folder(key, assert_output_is_existing_folder)
+
+
+@lru_cache(maxsize=1024)
+def _cached_resolve_module_filepath(key, assert_output_is_existing_filepath):
+    return _resolve_module_filepath(key, assert_output_is_existing_filepath)
+
+
+# These used to be defined here, then moved to xdol. Ours remember what paths resolved
+# to, so resolving the same modules again doesn't stat the filesystem again.
+# (So if a folder or __init__.py file is created or deleted, call their cache_clear().)
+def resolve_to_folder(obj, assert_output_is_existing_folder=True):
+    """The folder of a module, package, folder, or __init__.py file.
+
+    >>> import asyncio
+    >>> resolve_to_folder(asyncio) == os.path.dirname(asyncio.__file__)
+    True
+    """
+    key = _resolution_key(obj)
+    if key is None:
+        return _resolve_to_folder(obj, assert_output_is_existing_folder)
+    return _cached_resolve_to_folder(key, assert_output_is_existing_folder)
+
+
+def resolve_module_filepath(module_spec, assert_output_is_existing_filepath=True):
+    """The .py file of a module, package (its __init__.py), folder, or filepath.
+
+    >>> import asyncio
+    >>> resolve_module_filepath(asyncio) == asyncio.__file__
+    True
+    """
+    key = _resolution_key(module_spec)
+    if key is None:
+        return _resolve_module_filepath(module_spec, assert_output_is_existing_filepath)
+    return _cached_resolve_module_filepath(key, assert_output_is_existing_filepath)
+
+
+def _resolution_cache_clear():
+    _cached_resolve_to_folder.cache_clear()
+    _cached_resolve_module_filepath.cache_clear()
+
+
+resolve_to_folder.cache_clear = _resolution_cache_clear
+resolve_module_filepath.cache_clear = _resolution_cache_clear
+
+
 # Pattern: meshed
 def resolve_module_contents(module_spec, dflt=None, assert_output_is_str=True):
-    if not isinstance(module_spec, str) or os.path.isdir(module_spec):
+    # (contents with newlines can't be a path, so no need to stat those)
+    if not isinstance(module_spec, str) or (
+        "\n" not in module_spec and os.path.isdir(module_spec)
+    ):
         module_spec = resolve_module_filepath(module_spec)
-    if os.path.isfile(module_spec):
-        with open(module_spec, "rb") as fp:
-            module_bytes = fp.read()
-        return decode_or_default(module_bytes, dflt=dflt)
+    if isinstance(module_spec, str) and "\n" not in module_spec:
+        try:  # opening it is how we know if it's a file (no need for a stat call first)
+            with open(module_spec, "rb") as fp:
+                module_bytes = fp.read()
+        except PermissionError:  # a file, but we can't read it
+            raise
+        except (OSError, ValueError):  # not a file, so must be contents
+            pass
+        else:
+            return decode_or_default(module_bytes, dflt=dflt)
     if assert_output_is_str:
         assert isinstance(
             module_spec, str
@@ -183,6 +297,28 @@ def resolve_module_contents(module_spec, dflt=None, assert_output_is_str=True):
     return module_spec
 
 
+def iter_py_filepaths(rootdir, include_hidden=False):
+    """Generator of the paths of the .py files under rootdir (not walking __pycache__
+    folders, and skipping hidden files and folders, unless include_hidden is True).
+
+    >>> import asyncio
+    >>> rootdir = resolve_to_folder(asyncio)
+    >>> os.path.join(rootdir, 'locks.py') in iter_py_filepaths(rootdir)
+    True
+    """
+    for dirpath, dirnames, filenames in os.walk(rootdir):
+        dirnames[:] = [
+            d
+            for d in dirnames
+            if d != "__pycache__" and (include_hidden or not d.startswith("."))
+        ]
+        for filename in filenames:
+            if filename.endswith(".py") and (
+                include_hidden or not filename.startswith(".")
+            ):
+                yield os.path.join(dirpath, filename)
+
+
 # ---------------------------------------------------------------------------------------
 # TODO: Compare and merge
 # What's below was developed independently but has strong ties with what's above, so